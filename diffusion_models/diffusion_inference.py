@@ -69,7 +69,7 @@ class DiffusionInference:
       device=self.device,
     )
 
-    denoised_images = self.model.denoise(images)
+    denoised_images = self.model.denoise(images, return_intermediate=save_gif)
 
     if save_gif:
       pil_images = []
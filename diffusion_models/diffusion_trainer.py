@@ -28,6 +28,7 @@ class DiffusionTrainer:
     log_configuration: LogConfiguration = LogConfiguration(),
     reverse_transforms: Callable = lambda x: x,
     device: str = "cuda",
+    batch_transforms: Callable = lambda x: x,
   ):
     """A diffusion trainer framework.
 
@@ -42,9 +43,16 @@ class DiffusionTrainer:
       log_configuration: The logging configuration to use.
       reverse_transforms: The reverse transforms to use.
       device: The device to use.
+      batch_transforms: The transforms applied to each batch of images once
+        it is on the device. Use these for cheap elementwise operations
+        rather than running them on the dataloader workers.
     """
     self.model = model.to(device)
     """The diffusion model to use."""
+    if training_configuration.compile_model:
+      self.model = self.model.compile(
+        mode="reduce-overhead", fullgraph=True, dynamic=True
+      )
     self.optimizer = optimizer
     """The optimizer to use."""
     self.loss_function = loss_function
@@ -63,6 +71,7 @@ class DiffusionTrainer:
       num_workers=16,
       pin_memory=True,
       persistent_workers=True,
+      prefetch_factor=4,
     )
     """A torch dataloader."""
 
@@ -89,6 +98,9 @@ class DiffusionTrainer:
     )
     """A tensorboard manager instance."""
 
+    self.batch_transforms = batch_transforms
+    """A set of transforms applied to each batch on the device."""
+
     self.reverse_transforms = reverse_transforms
     """A set of reverse transforms."""
 
@@ -103,7 +115,10 @@ class DiffusionTrainer:
     """
     checkpoint = Checkpoint(
       epoch=epoch,
-      model_state_dict=self.model.state_dict(),
+      # Unwrap compiled models so checkpoints load into an eager model.
+      model_state_dict=getattr(
+        self.model, "_orig_mod", self.model
+      ).state_dict(),
       optimizer_state_dict=self.optimizer.state_dict(),
       scaler=self.scaler.state_dict()
       if self.training_configuration.mixed_precision_training
@@ -128,7 +143,9 @@ class DiffusionTrainer:
         global_step = epoch * len(self.dataloader) + step
 
         images, _ = batch
-        images = images.to(self.device)
+        # Batches come from pinned memory so the copy overlaps with compute.
+        images = images.to(self.device, non_blocking=True)
+        images = self.batch_transforms(images)
 
         noisy_images, noise, timesteps = self.model.diffuse(images=images)
 
@@ -136,6 +153,7 @@ class DiffusionTrainer:
 
         with torch.autocast(
           device_type=self.device,
+          dtype=torch.bfloat16,
           enabled=self.training_configuration.mixed_precision_training,
         ):
           prediction = self.model(noisy_images, timesteps)
@@ -198,7 +216,9 @@ class DiffusionTrainer:
         ),
         device=self.device,
       )
-      images = self.model.denoise(images)
+      images = self.model.denoise(
+        images, return_intermediate=True, verbose=False
+      )
       for step, images in enumerate(images[::-1]):
         self.tensorboard_manager.log_images(
           tag=f"Images at timestep {global_step}",
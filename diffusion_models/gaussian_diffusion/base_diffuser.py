@@ -1,8 +1,9 @@
 import abc
-from typing import List, TYPE_CHECKING
+from typing import Callable, List, TYPE_CHECKING
 from typing import Tuple
 
 import torch
+from tqdm import tqdm
 
 from diffusion_models.gaussian_diffusion.beta_schedulers import (
   BaseBetaScheduler,
@@ -64,19 +65,110 @@ class BaseDiffuser(abc.ABC):
 
   @abc.abstractmethod
   def denoise_batch(
-    self, images: torch.Tensor, model: "BaseDiffusionModel"
+    self,
+    images: torch.Tensor,
+    model: "BaseDiffusionModel",
+    parallel_seeds: int = 1,
+    return_intermediate: bool = False,
+    verbose: bool = True,
   ) -> List[torch.Tensor]:
     """Denoise a batch of images.
 
     Args:
       images: A tensor containing a batch of images to denoise.
       model: The model to be used for denoising.
+      parallel_seeds: The number of independent batches stacked along the
+        first dimension of ``images``. When greater than 1, ``images`` should
+        have shape ``(N, B, C, H, W)`` and all ``N`` batches are denoised
+        together in a single batch of ``N * B`` images.
+      return_intermediate: Whether to return the images produced at every
+        denoising step rather than only the final images. Intermediate images
+        are copied to host memory.
+      verbose: Whether to display a progress bar.
 
     Returns:
-      A list of tensors containing a batch of denoised images.
+      A list of tensors containing a batch of denoised images. Unless
+      ``return_intermediate`` is set, this only contains the final images.
+
+    Raises:
+      ValueError: If ``parallel_seeds`` does not match the shape of ``images``.
     """
     raise NotImplementedError()
 
+  def _denoise_loop(
+    self,
+    images: torch.Tensor,
+    prepare_step: Callable[
+      [torch.Tensor], Callable[[torch.Tensor, int], torch.Tensor]
+    ],
+    parallel_seeds: int = 1,
+    return_intermediate: bool = False,
+    verbose: bool = True,
+  ) -> List[torch.Tensor]:
+    """Run the denoising loop shared by every diffuser.
+
+    This handles the bookkeeping around the denoising steps: stacking
+    ``parallel_seeds`` batches into one, streaming intermediate images to host
+    memory and reshaping the results.
+
+    Args:
+      images: A batch of noisy images.
+      prepare_step: A function called once with the batch of images to
+        denoise. It returns the function denoising the images for a single
+        step, given the images and the index of the step.
+      parallel_seeds: The number of independent batches stacked in ``images``.
+      return_intermediate: Whether to return the images of every step.
+      verbose: Whether to display a progress bar.
+
+    Returns:
+      A list of tensors containing a batch of denoised images.
+
+    Raises:
+      ValueError: If ``parallel_seeds`` is greater than 1 and ``images`` is not
+        of shape ``(parallel_seeds, B, C, H, W)``.
+    """
+    if parallel_seeds > 1:
+      if images.dim() != 5 or images.shape[0] != parallel_seeds:
+        raise ValueError(
+          f"Expected images of shape ({parallel_seeds}, B, C, H, W) for "
+          f"parallel_seeds={parallel_seeds}, got {tuple(images.shape)}."
+        )
+      images = images.flatten(0, 1)
+
+    steps = self.steps
+    denoise_step = prepare_step(images)
+
+    staging_buffer = None
+    if return_intermediate and images.is_cuda:
+      # Copies to pinned memory are asynchronous and overlap with the
+      # following denoising steps.
+      staging_buffer = torch.empty(
+        (len(steps), *images.shape), dtype=images.dtype, pin_memory=True
+      )
+
+    denoised_images = []
+    for step, i in enumerate(
+      tqdm(steps, desc="Denoising", disable=not verbose)
+    ):
+      images = denoise_step(images, i)
+      if staging_buffer is not None:
+        denoised_images.append(
+          staging_buffer[step].copy_(images, non_blocking=True)
+        )
+      elif return_intermediate:
+        denoised_images.append(images)
+
+    if staging_buffer is not None:
+      torch.cuda.current_stream(images.device).synchronize()
+    if not return_intermediate:
+      denoised_images = [images]
+
+    if parallel_seeds > 1:
+      denoised_images = [
+        images.unflatten(0, (parallel_seeds, -1)) for images in denoised_images
+      ]
+    return denoised_images
+
   @abc.abstractmethod
   def to(self, device: str = "cpu"):
     """Moves the data to the specified device.
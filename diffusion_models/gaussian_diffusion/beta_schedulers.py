@@ -40,6 +40,14 @@ class BaseBetaScheduler:
     """The :math:`\\beta` computed according to :meth:`~.BaseBetaScheduler.sample_betas`."""
     self.alpha_bars = None
     """The :math:`\\bar{\\alpha}` computed according to :meth:`~.BaseBetaScheduler.compute_alpha_bar`."""
+    self.sqrt_alpha_bars = None
+    """:math:`\\sqrt{\\bar{\\alpha}}` for every step."""
+    self.sqrt_one_minus_alpha_bars = None
+    """:math:`\\sqrt{1 - \\bar{\\alpha}}` for every step."""
+    self.recip_sqrt_alpha_bars = None
+    """:math:`1 / \\sqrt{\\bar{\\alpha}}` for every step."""
+    self.log_one_minus_alpha_bars = None
+    """:math:`\\log(1 - \\bar{\\alpha})` for every step."""
 
     if initialize:
       self._initialize()
@@ -49,6 +57,15 @@ class BaseBetaScheduler:
   def _initialize(self):
     self.betas = self.sample_betas()
     self.alpha_bars = self.compute_alpha_bar()
+    self._cache_alpha_bar_terms()
+
+  def _cache_alpha_bar_terms(self):
+    # Precomputed once so that diffusers only need to gather them instead of
+    # recomputing them for every batch.
+    self.sqrt_alpha_bars = self.alpha_bars.sqrt()
+    self.sqrt_one_minus_alpha_bars = (1 - self.alpha_bars).sqrt()
+    self.recip_sqrt_alpha_bars = self.alpha_bars.rsqrt()
+    self.log_one_minus_alpha_bars = torch.log1p(-self.alpha_bars)
 
   def enforce_zero_terminal_snr(self):
     """Enforce terminal SNR by adjusting :math:`\\beta` and :math:`\\bar{\\alpha}`.
@@ -82,6 +99,7 @@ class BaseBetaScheduler:
     if len(alphas) == alpha_bar_length:
       self.betas = betas
       self.alpha_bars = alphas_bar
+      self._cache_alpha_bar_terms()
     else:
       logging.warning(
         "Got different alpha_bar length after enforcing zero SNR. Please check your beta scheduler"
@@ -115,6 +133,7 @@ class BaseBetaScheduler:
     """
     self.betas = self.betas.to(device)
     self.alpha_bars = self.alpha_bars.to(device)
+    self._cache_alpha_bar_terms()
     return self
 
   @classmethod
@@ -138,6 +157,7 @@ class BaseBetaScheduler:
     generic_beta_scheduler.steps = steps
     generic_beta_scheduler.betas = betas
     generic_beta_scheduler.alpha_bars = alpha_bars
+    generic_beta_scheduler._cache_alpha_bar_terms()
     return generic_beta_scheduler
 
 
@@ -1,10 +1,10 @@
+import math
 from enum import Enum
 from typing import List
+from typing import Optional
 from typing import Tuple
 
-import numpy as np
 import torch
-from tqdm import tqdm
 
 from diffusion_models.gaussian_diffusion.base_diffuser import BaseDiffuser
 from diffusion_models.gaussian_diffusion.beta_schedulers import (
@@ -14,9 +14,61 @@ from diffusion_models.models.base_diffusion_model import BaseDiffusionModel
 from diffusion_models.utils.schemas import Checkpoint, Timestep
 
 
+def _ddim_combine(
+  images: torch.Tensor,
+  epsilon_theta: torch.Tensor,
+  epsilon_t: Optional[torch.Tensor],
+  coef_x: torch.Tensor,
+  coef_eps: torch.Tensor,
+  sigma: torch.Tensor,
+) -> torch.Tensor:
+  images = coef_x * images + coef_eps * epsilon_theta
+  if epsilon_t is not None:
+    images = images + sigma * epsilon_t
+  return torch.clamp(images, -1.0, 1.0)
+
+
+# Compiled so that the whole update, including clamping, is fused into a single
+# elementwise kernel on GPU. Compilation is lazy, so CPU sampling keeps using
+# the eager version and does not require a C++ toolchain.
+_compiled_ddim_combine = torch.compile(_ddim_combine)
+
+
+AYS_SIGMAS = [
+  14.615,
+  6.475,
+  3.861,
+  2.697,
+  1.886,
+  1.396,
+  0.963,
+  0.652,
+  0.399,
+  0.152,
+  0.029,
+]
+"""The 10 step Stable Diffusion 1.5 noise levels from `"Align Your Steps"
+<https://arxiv.org/abs/2404.14507>`_."""
+
+
+def _loglinear_interp(
+  values: List[float], number_of_points: int
+) -> torch.Tensor:
+  # Resample a decreasing schedule to any length by interpolating in log space
+  # as recommended by the Align Your Steps authors.
+  log_values = torch.tensor(values, dtype=torch.float64).log()
+  positions = torch.linspace(
+    0, len(values) - 1, number_of_points, dtype=torch.float64
+  )
+  lower = positions.floor().long().clamp(max=len(values) - 2)
+  weights = positions - lower
+  return torch.lerp(log_values[lower], log_values[lower + 1], weights).exp()
+
+
 class DenoisingMode(str, Enum):
   Linear = "linear"
   Quadratic = "quadratic"
+  AYS = "ays"
 
 
 class DdimDiffuser(BaseDiffuser):
@@ -25,11 +77,28 @@ class DdimDiffuser(BaseDiffuser):
     beta_scheduler: BaseBetaScheduler,
     mode: DenoisingMode = DenoisingMode.Quadratic,
     number_of_steps: int = 20,
+    eta: float = 0.0,
+    cuda_graph: bool = False,
+    mixed_precision: bool = False,
   ):
     """Initializes the class instance.
 
     Args:
       beta_scheduler (BaseBetaScheduler): The beta scheduler instance to be used.
+      mode: The spacing of the timesteps used for denoising.
+      number_of_steps: The number of steps used for denoising.
+      eta: The amount of stochasticity in the denoising process. ``0.0``
+        corresponds to deterministic DDIM sampling.
+      cuda_graph: Whether to capture the denoising step in a CUDA graph and
+        replay it for every step. This removes most of the Python and kernel
+        launch overhead but requires the model to be capturable. The graph is
+        reused until the shape, dtype or device of the images, the model or
+        the denoising settings change. Do not combine this with a model
+        compiled with ``mode="reduce-overhead"``, which already captures its
+        own CUDA graphs and cannot be nested in another capture.
+      mixed_precision: Whether to run the model in ``bfloat16`` during
+        denoising. The DDIM update itself is always computed in the precision
+        of the images.
 
     """
     super().__init__(beta_scheduler)
@@ -38,37 +107,130 @@ class DdimDiffuser(BaseDiffuser):
     """Number of steps to use in the denoising process."""
 
     self.mode = mode
-    """Linear or Quadratic sampling."""
+    """Linear, Quadratic or Align Your Steps sampling."""
+
+    self.eta = eta
+    """The amount of stochasticity in the denoising process."""
+
+    self.cuda_graph = cuda_graph
+    """Whether to replay the denoising step from a CUDA graph on GPU."""
+
+    self.mixed_precision = mixed_precision
+    """Whether to run the model in bfloat16 during denoising."""
 
     self.device: str = "cpu"
     """The device to use. Defaults to cpu."""
 
+    self._cached_steps = None
+    self._noise_buffer = None
+    self._cuda_graph = None
+
+  def __setattr__(self, name, value):
+    # The timesteps and coefficients computed in steps, and the CUDA graph
+    # reading them, depend on these so they are rebuilt whenever one changes.
+    if name in (
+      "beta_scheduler",
+      "number_of_steps",
+      "mode",
+      "eta",
+      "mixed_precision",
+      "device",
+    ):
+      self.__dict__["_cached_steps"] = None
+      self.__dict__["_cuda_graph"] = None
+    super().__setattr__(name, value)
+
   @property
   def steps(self) -> List[int]:
+    if self._cached_steps is not None:
+      return self._cached_steps
+
     if self.mode == DenoisingMode.Linear:
       a = self.beta_scheduler.steps // self.number_of_steps
-      time_steps = np.asarray(list(range(0, self.beta_scheduler.steps, a)))
+      if a == 0:
+        raise ValueError(
+          f"Linear denoising requires number_of_steps "
+          f"({self.number_of_steps}) to be at most the number of steps of "
+          f"the beta scheduler ({self.beta_scheduler.steps})."
+        )
+      time_steps = torch.arange(self.number_of_steps, device=self.device) * a
+    elif self.mode == DenoisingMode.AYS:
+      time_steps = self._ays_time_steps()
     else:
       time_steps = (
-        np.linspace(
-          0, np.sqrt(self.beta_scheduler.steps * 0.8), self.number_of_steps
+        torch.linspace(
+          0,
+          math.sqrt(self.beta_scheduler.steps * 0.8),
+          self.number_of_steps,
+          dtype=torch.float64,
+          device=self.device,
         )
         ** 2
-      ).astype(int)
+      ).long()
     self._time_steps = time_steps + 1
-    self._time_steps_prev = np.concatenate([[0], time_steps[:-1]])
-    return list(range(self.number_of_steps))[::-1]
+    self._time_steps_prev = torch.cat(
+      [torch.zeros(1, dtype=torch.long, device=self.device), time_steps[:-1]]
+    )
+    self._compute_coefficients()
+    self._cached_steps = list(range(self.number_of_steps))[::-1]
+    return self._cached_steps
+
+  def _ays_time_steps(self) -> torch.Tensor:
+    sigmas = _loglinear_interp(AYS_SIGMAS, self.number_of_steps)
+    alpha_bars = self.beta_scheduler.alpha_bars.to(self.device)
+    # Convert each noise level to its alpha bar (VP parameterisation) and
+    # match it to the closest timestep of the beta scheduler.
+    targets = (1 / (1 + sigmas**2)).to(alpha_bars)
+    # The alpha bars decrease over time, searchsorted needs them ascending.
+    ascending = alpha_bars.flip(0)
+    positions = torch.searchsorted(ascending, targets)
+    # searchsorted only gives the insertion point, the closest timestep is
+    # either side of it.
+    lower = (positions - 1).clamp(0, len(ascending) - 1)
+    upper = positions.clamp(0, len(ascending) - 1)
+    nearest = torch.where(
+      (ascending[lower] - targets).abs() <= (ascending[upper] - targets).abs(),
+      lower,
+      upper,
+    )
+    time_steps = len(alpha_bars) - 1 - nearest
+    time_steps = (time_steps - 1).clamp(0, self.beta_scheduler.steps - 2)
+    return time_steps.sort().values
+
+  def _compute_coefficients(self):
+    # The DDIM update only depends on the timestep pair, so its coefficients
+    # are computed once for all steps rather than at every denoising step.
+    beta_scheduler = self.beta_scheduler
+    t, t_prev = self._time_steps, self._time_steps_prev
+
+    alpha_bars = beta_scheduler.alpha_bars.float()
+    alpha_bar_t = alpha_bars[t]
+    alpha_bar_t_prev = alpha_bars[t_prev]
+    sqrt_alpha_bar_t_prev = beta_scheduler.sqrt_alpha_bars.float()[t_prev]
+    rsqrt_alpha_bar_t = beta_scheduler.recip_sqrt_alpha_bars.float()[t]
+    sqrt_one_minus_alpha_bar_t = (
+      beta_scheduler.sqrt_one_minus_alpha_bars.float()[t]
+    )
 
-  def get_timestep(self, number_of_images: int, idx: int) -> Timestep:
-    timestep = torch.full(
-      (number_of_images,), self._time_steps[idx], device=self.device
+    sigma = self.eta * torch.sqrt(
+      (1 - alpha_bar_t_prev)
+      / (1 - alpha_bar_t)
+      * (1 - alpha_bar_t / alpha_bar_t_prev)
     )
-    timestep_prev = torch.full(
-      (number_of_images,), self._time_steps_prev[idx], device=self.device
+    self._coef_x = sqrt_alpha_bar_t_prev * rsqrt_alpha_bar_t
+    # Clamped as rounding can make the argument slightly negative when eta > 0
+    # and alpha_bar_t_prev is close to 1.
+    direction = (1 - alpha_bar_t_prev - sigma**2).clamp_min(0).sqrt()
+    self._coef_eps = direction - (
+      sqrt_alpha_bar_t_prev * sqrt_one_minus_alpha_bar_t * rsqrt_alpha_bar_t
     )
+    self._sigma = sigma
+
+  def get_timestep(self, number_of_images: int, idx: int) -> Timestep:
     return Timestep(
-      current=timestep,
-      previous=timestep_prev,
+      current=self._time_steps[idx].repeat(number_of_images),
+      previous=self._time_steps_prev[idx].repeat(number_of_images),
+      index=idx,
     )
 
   @classmethod
@@ -112,15 +274,20 @@ class DdimDiffuser(BaseDiffuser):
   def _diffuse_batch(
     self, images: torch.Tensor, timesteps: torch.Tensor
   ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-    noise = torch.randn_like(images, device=self.device)
-
-    alpha_bar_t = self.beta_scheduler.alpha_bars.gather(dim=0, index=timesteps)
-
-    alpha_bar_t = alpha_bar_t.reshape((-1, *((1,) * (len(images.shape) - 1))))
+    if images.dim() == 4:
+      images = images.contiguous(memory_format=torch.channels_last)
+    noise = torch.randn_like(images)
+
+    shape = (-1, *((1,) * (len(images.shape) - 1)))
+    mu = self.beta_scheduler.sqrt_alpha_bars.gather(dim=0, index=timesteps)
+    sigma = self.beta_scheduler.sqrt_one_minus_alpha_bars.gather(
+      dim=0, index=timesteps
+    )
 
-    mu = torch.sqrt(alpha_bar_t)
-    sigma = torch.sqrt(1 - alpha_bar_t)
-    images = mu * images + sigma * noise
+    images = torch.addcmul(
+      mu.reshape(shape) * images, sigma.reshape(shape), noise
+    )
+    torch._dynamo.maybe_mark_dynamic(images, 0)
     return images, noise, timesteps
 
   def diffuse_batch(
@@ -152,43 +319,143 @@ class DdimDiffuser(BaseDiffuser):
     images: torch.Tensor,
     model: torch.nn.Module,
     timestep: Timestep,
-    eta: float = 0.0,
+    noise: Optional[torch.Tensor] = None,
   ) -> torch.Tensor:
-    current_timestep = timestep.current
-    previous_timestep = timestep.previous
+    idx = timestep.index
+    if idx is None:
+      raise ValueError(
+        "DDIM denoising requires the index of the denoising step, use "
+        "get_timestep to build the timestep."
+      )
+    # A tensor index is only used while capturing CUDA graphs. It is gathered
+    # on device as indexing with it would synchronise with the host.
+    coef_x, coef_eps, sigma = (
+      coefficients.index_select(0, idx)
+      if isinstance(idx, torch.Tensor)
+      else coefficients[idx]
+      for coefficients in (self._coef_x, self._coef_eps, self._sigma)
+    )
 
-    epsilon_theta = model(images, current_timestep)
+    images = images.contiguous(memory_format=torch.channels_last)
+    torch._dynamo.maybe_mark_dynamic(images, 0)
+    with torch.autocast(
+      device_type=images.device.type,
+      dtype=torch.bfloat16,
+      enabled=self.mixed_precision,
+    ):
+      epsilon_theta = model(images, timestep.current)
+
+    # Deterministic sampling does not need any noise.
+    epsilon_t = None
+    if self.eta != 0.0:
+      epsilon_t = (
+        self._sample_noise(images) if noise is None else noise.normal_()
+      )
 
-    alpha_bar_t = self.beta_scheduler.alpha_bars.gather(
-      dim=0, index=current_timestep
-    ).reshape(-1, 1, 1, 1)
+    ddim_combine = _compiled_ddim_combine if images.is_cuda else _ddim_combine
+    return ddim_combine(
+      images,
+      epsilon_theta,
+      epsilon_t,
+      coef_x.to(images.dtype),
+      coef_eps.to(images.dtype),
+      sigma.to(images.dtype),
+    )
 
-    alpha_bar_t_prev = self.beta_scheduler.alpha_bars.gather(
-      dim=0, index=previous_timestep
-    ).reshape(-1, 1, 1, 1)
+  def _timestep_table(
+    self, number_of_images: int, device: torch.device
+  ) -> Timestep:
+    # Materialise the timesteps of every denoising step at once, rows are
+    # then indexed by step instead of allocating new tensors at every step.
+    def table(time_steps):
+      return (
+        time_steps.to(device)
+        .unsqueeze(1)
+        .expand(-1, number_of_images)
+        .contiguous()
+      )
 
-    sigma = eta * torch.sqrt(
-      (1 - alpha_bar_t_prev)
-      / (1 - alpha_bar_t)
-      * (1 - alpha_bar_t / alpha_bar_t_prev)
+    return Timestep(
+      current=table(self._time_steps),
+      previous=table(self._time_steps_prev),
     )
 
-    epsilon_t = torch.randn_like(images)
-
-    mu = (
-      torch.sqrt(alpha_bar_t_prev / alpha_bar_t) * images
-      + (
-        torch.sqrt(1 - alpha_bar_t_prev - sigma**2)
-        - torch.sqrt((alpha_bar_t_prev * (1 - alpha_bar_t)) / alpha_bar_t)
+  def _sample_noise(self, images: torch.Tensor) -> torch.Tensor:
+    # The noise buffer is reused across steps and only reallocated when the
+    # images change.
+    noise_buffer = self._noise_buffer
+    if (
+      noise_buffer is None
+      or noise_buffer.shape != images.shape
+      or noise_buffer.dtype != images.dtype
+      or noise_buffer.device != images.device
+    ):
+      self._noise_buffer = torch.empty_like(images)
+    return self._noise_buffer.normal_()
+
+  def _capture_denoise_step(
+    self, images: torch.Tensor, model: "BaseDiffusionModel"
+  ) -> Tuple[torch.cuda.CUDAGraph, torch.Tensor, torch.Tensor]:
+    key = (images.shape, images.dtype, images.device, model)
+    if self._cuda_graph is not None and self._cuda_graph[0] == key:
+      _, graph, static_idx, static_images, _, _ = self._cuda_graph
+      static_images.copy_(images)
+      return graph, static_idx, static_images
+
+    device = images.device
+    timestep_table = self._timestep_table(images.shape[0], device)
+
+    # The graph reads the step index and images from static buffers, they are
+    # updated in place between replays. It also owns its noise buffer as the
+    # shared one is reallocated by eager calls with different images.
+    static_idx = torch.zeros(1, dtype=torch.long, device=device)
+    static_images = images.clone()
+    static_noise = torch.empty_like(images) if self.eta != 0.0 else None
+
+    def step():
+      timestep = Timestep(
+        current=timestep_table.current.index_select(0, static_idx)[0],
+        previous=timestep_table.previous.index_select(0, static_idx)[0],
+        index=static_idx,
       )
-      * epsilon_theta
+      static_images.copy_(
+        self._denoise_step(
+          static_images, model=model, timestep=timestep, noise=static_noise
+        )
+      )
+
+    # Warm up on a side stream before capturing as recommended by PyTorch.
+    stream = torch.cuda.Stream(device=device)
+    stream.wait_stream(torch.cuda.current_stream(device))
+    with torch.cuda.stream(stream):
+      for _ in range(3):
+        step()
+    torch.cuda.current_stream(device).wait_stream(stream)
+
+    graph = torch.cuda.CUDAGraph()
+    with torch.cuda.graph(graph):
+      step()
+
+    static_images.copy_(images)
+    # Every tensor read or written by the graph is kept here so that its memory
+    # is not freed and reused while the graph is cached.
+    self._cuda_graph = (
+      key,
+      graph,
+      static_idx,
+      static_images,
+      timestep_table,
+      static_noise,
     )
-    return mu + sigma * epsilon_t
+    return graph, static_idx, static_images
 
   def denoise_batch(
     self,
     images: torch.Tensor,
     model: "BaseDiffusionModel",
+    parallel_seeds: int = 1,
+    return_intermediate: bool = False,
+    verbose: bool = True,
   ) -> List[torch.Tensor]:
     """Denoise a batch of images.
 
@@ -197,19 +464,48 @@ class DdimDiffuser(BaseDiffuser):
     Args:
       images: A batch of noisy images.
       model: The model to be used for denoising.
+      parallel_seeds: The number of independent batches stacked in ``images``.
+      return_intermediate: Whether to return the images of every step.
+      verbose: Whether to display a progress bar.
 
     Returns:
       A list of tensors containing a batch of denoised images.
     """
-    denoised_images = []
-    for i in tqdm(self.steps, desc="Denoising"):
-      timestep = self.get_timestep(images.shape[0], idx=i)
-
-      images = self._denoise_step(
-        images,
-        model=model,
-        timestep=timestep,
-      )
-      images = torch.clamp(images, -1.0, 1.0)
-      denoised_images.append(images)
-    return denoised_images
+
+    def prepare_step(images: torch.Tensor):
+      if self.cuda_graph and images.is_cuda:
+        graph, static_idx, static_images = self._capture_denoise_step(
+          images, model
+        )
+        last_step = self.steps[-1]
+
+        def denoise_step(images: torch.Tensor, i: int) -> torch.Tensor:
+          static_idx.fill_(i)
+          graph.replay()
+          # The static images are overwritten by the next call, so the final
+          # images are returned as a copy.
+          if i == last_step:
+            return static_images.clone()
+          return static_images
+
+        return denoise_step
+
+      timestep_table = self._timestep_table(images.shape[0], images.device)
+
+      def denoise_step(images: torch.Tensor, i: int) -> torch.Tensor:
+        timestep = Timestep(
+          current=timestep_table.current[i],
+          previous=timestep_table.previous[i],
+          index=i,
+        )
+        return self._denoise_step(images, model=model, timestep=timestep)
+
+      return denoise_step
+
+    return self._denoise_loop(
+      images,
+      prepare_step=prepare_step,
+      parallel_seeds=parallel_seeds,
+      return_intermediate=return_intermediate,
+      verbose=verbose,
+    )
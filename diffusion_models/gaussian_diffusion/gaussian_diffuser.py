@@ -1,7 +1,6 @@
 from typing import TYPE_CHECKING, List, Tuple
 
 import torch
-from tqdm import tqdm
 
 from diffusion_models.gaussian_diffusion.base_diffuser import BaseDiffuser
 from diffusion_models.gaussian_diffusion.beta_schedulers import (
@@ -76,15 +75,20 @@ class GaussianDiffuser(BaseDiffuser):
   def _diffuse_batch(
     self, images: torch.Tensor, timesteps: torch.Tensor
   ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-    noise = torch.randn_like(images, device=self.device)
-
-    alpha_bar_t = self.beta_scheduler.alpha_bars.gather(dim=0, index=timesteps)
-
-    alpha_bar_t = alpha_bar_t.reshape((-1, *((1,) * (len(images.shape) - 1))))
+    if images.dim() == 4:
+      images = images.contiguous(memory_format=torch.channels_last)
+    noise = torch.randn_like(images)
+
+    shape = (-1, *((1,) * (len(images.shape) - 1)))
+    mu = self.beta_scheduler.sqrt_alpha_bars.gather(dim=0, index=timesteps)
+    sigma = self.beta_scheduler.sqrt_one_minus_alpha_bars.gather(
+      dim=0, index=timesteps
+    )
 
-    mu = torch.sqrt(alpha_bar_t)
-    sigma = torch.sqrt(1 - alpha_bar_t)
-    images = mu * images + sigma * noise
+    images = torch.addcmul(
+      mu.reshape(shape) * images, sigma.reshape(shape), noise
+    )
+    torch._dynamo.maybe_mark_dynamic(images, 0)
     return images, noise, timesteps
 
   def diffuse_batch(
@@ -115,15 +119,18 @@ class GaussianDiffuser(BaseDiffuser):
     self, images: torch.Tensor, model: torch.nn.Module, timestep: Timestep
   ) -> torch.Tensor:
     current_timestep = timestep.current
+    images = images.contiguous(memory_format=torch.channels_last)
+    torch._dynamo.maybe_mark_dynamic(images, 0)
     beta_t = self.beta_scheduler.betas[current_timestep].reshape(-1, 1, 1, 1)
     alpha_t = 1 - beta_t
-    alpha_bar_t = self.beta_scheduler.alpha_bars.gather(
-      dim=0, index=current_timestep
-    ).reshape(-1, 1, 1, 1)
+    sqrt_one_minus_alpha_bar_t = (
+      self.beta_scheduler.sqrt_one_minus_alpha_bars.gather(
+        dim=0, index=current_timestep
+      ).reshape(-1, 1, 1, 1)
+    )
     mu = (1 / torch.sqrt(alpha_t)) * (
       images
-      - model(images, current_timestep)
-      * (beta_t / torch.sqrt(1 - alpha_bar_t))
+      - model(images, current_timestep) * (beta_t / sqrt_one_minus_alpha_bar_t)
     )
 
     if current_timestep[0] == 0:
@@ -136,6 +143,9 @@ class GaussianDiffuser(BaseDiffuser):
     self,
     images: torch.Tensor,
     model: "BaseDiffusionModel",
+    parallel_seeds: int = 1,
+    return_intermediate: bool = False,
+    verbose: bool = True,
   ) -> List[torch.Tensor]:
     """Denoise a batch of images.
 
@@ -144,14 +154,23 @@ class GaussianDiffuser(BaseDiffuser):
     Args:
       images: A batch of noisy images.
       model: The model to be used for denoising.
+      parallel_seeds: The number of independent batches stacked in ``images``.
+      return_intermediate: Whether to return the images of every step.
+      verbose: Whether to display a progress bar.
 
     Returns:
       A list of tensors containing a batch of denoised images.
     """
-    denoised_images = []
-    for i in tqdm(self.steps, desc="Denoising"):
+
+    def denoise_step(images: torch.Tensor, i: int) -> torch.Tensor:
       timestep = self.get_timestep(images.shape[0], idx=i)
       images = self._denoise_step(images, model=model, timestep=timestep)
-      images = torch.clamp(images, -1.0, 1.0)
-      denoised_images.append(images)
-    return denoised_images
+      return torch.clamp(images, -1.0, 1.0)
+
+    return self._denoise_loop(
+      images,
+      prepare_step=lambda images: denoise_step,
+      parallel_seeds=parallel_seeds,
+      return_intermediate=return_intermediate,
+      verbose=verbose,
+    )
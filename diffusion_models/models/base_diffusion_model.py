@@ -1,5 +1,5 @@
 import abc
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import torch
 from torch import nn
@@ -45,16 +45,32 @@ class BaseDiffusionModel(nn.Module, abc.ABC):
     """
     return self.diffuser.diffuse_batch(images=images)
 
-  def denoise(self, images: torch.Tensor) -> List[torch.Tensor]:
+  def denoise(
+    self,
+    images: torch.Tensor,
+    parallel_seeds: int = 1,
+    return_intermediate: bool = False,
+    verbose: bool = True,
+  ) -> List[torch.Tensor]:
     """Denoise a batch of images.
 
     Args:
       images: A tensor containing a batch of images to denoise.
+      parallel_seeds: The number of independent batches stacked in ``images``
+        (see :meth:`~.BaseDiffuser.denoise_batch`).
+      return_intermediate: Whether to return the images of every step.
+      verbose: Whether to display a progress bar.
 
     Returns:
       A list of tensors containing a batch of denoised images.
     """
-    return self.diffuser.denoise_batch(images=images, model=self)
+    return self.diffuser.denoise_batch(
+      images=images,
+      model=self,
+      parallel_seeds=parallel_seeds,
+      return_intermediate=return_intermediate,
+      verbose=verbose,
+    )
 
   @abc.abstractmethod
   def forward(
@@ -76,7 +92,11 @@ class BaseDiffusionModel(nn.Module, abc.ABC):
     """
     raise NotImplementedError
 
-  def to(self, device: str = "cpu") -> "BaseDiffusionModel":
+  def to(
+    self,
+    device: Optional[str] = None,
+    memory_format: torch.memory_format = torch.preserve_format,
+  ) -> "BaseDiffusionModel":
     """Moves the model to the specified device.
 
     This performs a similar behaviour to the `to` method of PyTorch. moving the
@@ -84,20 +104,49 @@ class BaseDiffusionModel(nn.Module, abc.ABC):
 
     Args:
       device: The device to which the method should move the object.
-        Default is "cpu".
+        If omitted, the model stays on its current device.
+      memory_format: The desired memory format of the 4D parameters and
+        buffers of the model. Use ``torch.channels_last`` for faster
+        convolutions on recent GPUs. Defaults to ``torch.preserve_format``.
+
+    Example:
+      >>> model = model.to(memory_format=torch.channels_last)
     """
-    new_self = super(BaseDiffusionModel, self).to(device)
+    if device is None:
+      return super(BaseDiffusionModel, self).to(memory_format=memory_format)
+
+    new_self = super(BaseDiffusionModel, self).to(
+      device, memory_format=memory_format
+    )
     new_self.diffuser = new_self.diffuser.to(device)
     return new_self
 
   def compile(self, *args, **kwargs):
     """Compiles the diffusion model.
 
-    This performs a similar behaviour to the `compile` method of PyTorch.
+    This performs a similar behaviour to the `compile` method of PyTorch. The
+    compiled model is also used for every denoising step of
+    :meth:`~.BaseDiffusionModel.denoise`.
 
     Returns:
       A compiled diffusion model.
     """
     model = torch.compile(self, *args, **kwargs)
     model.to = self.to
+
+    def denoise(
+      images: torch.Tensor,
+      parallel_seeds: int = 1,
+      return_intermediate: bool = False,
+      verbose: bool = True,
+    ) -> List[torch.Tensor]:
+      return self.diffuser.denoise_batch(
+        images=images,
+        model=model,
+        parallel_seeds=parallel_seeds,
+        return_intermediate=return_intermediate,
+        verbose=verbose,
+      )
+
+    model.denoise = denoise
     return model
@@ -29,9 +29,22 @@ class TrainingConfiguration:
   checkpoint_rate: int = 100
   """The rate at which checkpoints are saved.."""
   mixed_precision_training: bool = False  # TODO: This is not complete yet
-  """Whether or not to use automatic mixed precision training."""
+  """Whether or not to use automatic mixed precision (bfloat16) training."""
   gradient_clip: Optional[float] = None  # TODO: This is not complete yet
   """Whether or not to clip gradients."""
+  compile_model: bool = False
+  """Whether or not to compile the model with ``torch.compile`` before training.
+
+  The model is compiled with dynamic shapes so that sampling images for
+  logging, with a different batch size than training, does not trigger a
+  recompilation. The diffusers also mark the batch dimension of the images they
+  pass to the model as dynamic for the same reason. This comes at the cost of
+  slightly less aggressive fusion.
+
+  The model is compiled with ``mode="reduce-overhead"``, which uses CUDA graphs,
+  so it should not be combined with a diffuser capturing its own CUDA graph
+  (see ``DdimDiffuser(cuda_graph=True)``).
+  """
 
 
 @dataclass
@@ -150,3 +163,4 @@ class OldCheckpoint:
 class Timestep:
   current: torch.Tensor
   previous: Optional[torch.Tensor] = None
+  index: Optional[Union[int, torch.Tensor]] = None
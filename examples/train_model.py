@@ -6,11 +6,12 @@ for a simple diffusion model and constitutes a good starting point.
 .. literalinclude:: /../../examples/train_model.py
    :language: python
    :linenos:
-   :lines: 14-102
+   :lines: 14-106
 """
 
 __all__ = []
 
+import torch
 from torch.nn import functional as F
 from torch.optim import AdamW
 from torchvision import datasets
@@ -38,7 +39,8 @@ if __name__ == "__main__":
     number_of_epochs=500,
     training_name="ReworkedFrameworkBase",
     checkpoint_rate=100,
-    mixed_precision_training=False,
+    mixed_precision_training=True,
+    compile_model=True,
     # gradient_clip=0.1,
   )
   log_configuration = LogConfiguration(
@@ -57,15 +59,15 @@ if __name__ == "__main__":
     ),
   )
 
+  model = model.to(memory_format=torch.channels_last)
+
   print("Num params: ", sum(p.numel() for p in model.parameters()))
-  # model = model.compile(fullgraph=True, mode="reduce-overhead")
 
   # Define Image Transforms and Reverse Transforms
   image_transforms = v2.Compose(
     [
       v2.ToImage(),
       v2.Resize((image_size, image_size)),
-      v2.Lambda(lambda x: (x + 1) / 2),
     ]
   )
 
@@ -90,6 +92,8 @@ if __name__ == "__main__":
     optimizer=AdamW(
       model.parameters(), lr=training_configuration.learning_rate
     ),
+    # Run on the GPU by the trainer, once batches have been copied.
+    batch_transforms=lambda x: (x + 1) / 2,
     reverse_transforms=reverse_transforms,
     training_configuration=training_configuration,
     loss_function=F.l1_loss,
@@ -61,6 +61,16 @@ class TestBaseBetaScheduler:
         assert scheduler.steps == steps
         assert torch.equal(scheduler.betas, betas)
         assert torch.equal(scheduler.alpha_bars, alpha_bars)
+        assert torch.allclose(scheduler.sqrt_alpha_bars, alpha_bars.sqrt())
+        assert torch.allclose(
+            scheduler.sqrt_one_minus_alpha_bars, (1 - alpha_bars).sqrt()
+        )
+        assert torch.allclose(
+            scheduler.recip_sqrt_alpha_bars, 1 / alpha_bars.sqrt()
+        )
+        assert torch.allclose(
+            scheduler.log_one_minus_alpha_bars, torch.log(1 - alpha_bars)
+        )
 
 
 class TestLinearBetaScheduler:
@@ -0,0 +1,303 @@
+import pytest
+import torch
+
+from diffusion_models.gaussian_diffusion.beta_schedulers import \
+    LinearBetaScheduler
+from diffusion_models.gaussian_diffusion.ddimm_diffuser import AYS_SIGMAS, \
+    DdimDiffuser, DenoisingMode, _loglinear_interp
+from diffusion_models.utils.schemas import Timestep
+
+
+class ConstantNoiseModel(torch.nn.Module):
+    def forward(self, x, timestep):
+        return torch.full_like(x, 0.1)
+
+
+class TimestepNoiseModel(torch.nn.Module):
+    def forward(self, x, timestep):
+        return torch.ones_like(x) * (timestep.reshape(-1, 1, 1, 1) / 100)
+
+
+class ConvNoiseModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(3, 3, kernel_size=3, padding=1)
+
+    def forward(self, x, timestep):
+        return self.conv(x)
+
+
+def reference_denoise_step(alpha_bars, images, epsilon_theta, timestep):
+    alpha_bar_t = alpha_bars[timestep.current].reshape(-1, 1, 1, 1)
+    alpha_bar_t_prev = alpha_bars[timestep.previous].reshape(-1, 1, 1, 1)
+    mu = (
+        torch.sqrt(alpha_bar_t_prev / alpha_bar_t) * images
+        + (
+            torch.sqrt(1 - alpha_bar_t_prev)
+            - torch.sqrt((alpha_bar_t_prev * (1 - alpha_bar_t)) / alpha_bar_t)
+        )
+        * epsilon_theta
+    )
+    return torch.clamp(mu, -1.0, 1.0)
+
+
+class TestDdimDiffuser:
+    def setup_method(self):
+        self.beta_scheduler = LinearBetaScheduler(steps=100)
+        self.model = ConstantNoiseModel()
+
+    @pytest.mark.parametrize(
+        "mode",
+        [DenoisingMode.Linear, DenoisingMode.Quadratic, DenoisingMode.AYS]
+    )
+    def test_steps(self, mode):
+        diffuser = DdimDiffuser(self.beta_scheduler, mode=mode, number_of_steps=10)
+
+        steps = diffuser.steps
+
+        assert steps == list(range(10))[::-1]
+        assert len(diffuser._coef_x) == 10
+        assert len(diffuser._coef_eps) == 10
+        assert torch.all(diffuser._sigma == 0)
+
+    def test_linear_steps_exceeding_beta_scheduler(self):
+        diffuser = DdimDiffuser(
+            LinearBetaScheduler(steps=10),
+            mode=DenoisingMode.Linear,
+            number_of_steps=20,
+        )
+
+        with pytest.raises(ValueError):
+            diffuser.steps
+
+    def test_coefficients_are_finite_with_eta(self):
+        diffuser = DdimDiffuser(self.beta_scheduler, number_of_steps=10, eta=1.0)
+
+        diffuser.steps
+
+        assert torch.isfinite(diffuser._coef_x).all()
+        assert torch.isfinite(diffuser._coef_eps).all()
+        assert torch.isfinite(diffuser._sigma).all()
+
+    def test_denoise_step_with_eta(self):
+        diffuser = DdimDiffuser(self.beta_scheduler, number_of_steps=10, eta=1.0)
+        images = torch.randn(2, 3, 8, 8)
+
+        for i in diffuser.steps:
+            timestep = diffuser.get_timestep(images.shape[0], idx=i)
+            images = diffuser._denoise_step(images, self.model, timestep)
+
+        assert torch.isfinite(images).all()
+        assert diffuser._noise_buffer.shape == images.shape
+
+    def test_denoise_step_without_index(self):
+        diffuser = DdimDiffuser(self.beta_scheduler, number_of_steps=10)
+        images = torch.randn(2, 3, 8, 8)
+        diffuser.steps
+        timestep = diffuser.get_timestep(images.shape[0], idx=0)
+
+        with pytest.raises(ValueError):
+            diffuser._denoise_step(
+                images,
+                self.model,
+                Timestep(current=timestep.current, previous=timestep.previous),
+            )
+
+    def test_steps_are_cached(self):
+        diffuser = DdimDiffuser(self.beta_scheduler, number_of_steps=10)
+
+        steps = diffuser.steps
+        coef_x = diffuser._coef_x
+
+        assert diffuser.steps is steps
+        assert diffuser._coef_x is coef_x
+
+        diffuser.number_of_steps = 5
+
+        assert diffuser.steps == list(range(5))[::-1]
+        assert len(diffuser._coef_x) == 5
+
+    @pytest.mark.parametrize(
+        "mode",
+        [DenoisingMode.Linear, DenoisingMode.Quadratic, DenoisingMode.AYS]
+    )
+    def test_denoise_step_matches_closed_form(self, mode):
+        diffuser = DdimDiffuser(self.beta_scheduler, mode=mode, number_of_steps=10)
+        images = torch.randn(2, 3, 8, 8)
+
+        for i in diffuser.steps:
+            timestep = diffuser.get_timestep(images.shape[0], idx=i)
+            result = diffuser._denoise_step(images, self.model, timestep)
+            expected = reference_denoise_step(
+                self.beta_scheduler.alpha_bars,
+                images,
+                self.model(images, timestep.current),
+                timestep,
+            )
+            assert torch.allclose(result, expected, atol=1e-5)
+
+    def test_diffuse_batch(self):
+        diffuser = DdimDiffuser(self.beta_scheduler)
+        images = torch.randn(4, 3, 8, 8)
+
+        noisy_images, noise, timesteps = diffuser.diffuse_batch(images)
+
+        alpha_bar_t = self.beta_scheduler.alpha_bars[timesteps].reshape(
+            -1, 1, 1, 1
+        )
+        expected = (
+            torch.sqrt(alpha_bar_t) * images
+            + torch.sqrt(1 - alpha_bar_t) * noise
+        )
+        assert noisy_images.shape == images.shape
+        assert torch.allclose(noisy_images, expected, atol=1e-6)
+
+    @pytest.mark.parametrize("number_of_steps", [4, 10, 15])
+    def test_ays_time_steps(self, number_of_steps):
+        diffuser = DdimDiffuser(
+            self.beta_scheduler,
+            mode=DenoisingMode.AYS,
+            number_of_steps=number_of_steps,
+        )
+
+        time_steps = diffuser._ays_time_steps()
+
+        assert len(time_steps) == number_of_steps
+        assert time_steps.min() >= 0
+        assert time_steps.max() <= self.beta_scheduler.steps - 2
+        assert (time_steps[1:] >= time_steps[:-1]).all()
+
+    def test_ays_time_steps_nearest_alpha_bar(self):
+        diffuser = DdimDiffuser(
+            self.beta_scheduler, mode=DenoisingMode.AYS, number_of_steps=10
+        )
+        sigmas = _loglinear_interp(AYS_SIGMAS, 10)
+        alpha_bars = self.beta_scheduler.alpha_bars
+
+        expected = []
+        for sigma in sigmas.tolist():
+            target = 1 / (1 + sigma**2)
+            distances = [abs(a - target) for a in alpha_bars.tolist()]
+            nearest = distances.index(min(distances))
+            expected.append(min(max(nearest - 1, 0), len(alpha_bars) - 2))
+
+        time_steps = diffuser._ays_time_steps()
+
+        assert time_steps.tolist() == sorted(expected)
+
+    def test_denoise_batch(self):
+        diffuser = DdimDiffuser(self.beta_scheduler, number_of_steps=5)
+        images = torch.randn(2, 3, 8, 8)
+
+        denoised_images = diffuser.denoise_batch(images, self.model)
+
+        assert len(denoised_images) == 1
+        assert denoised_images[-1].shape == images.shape
+
+    def test_denoise_batch_return_intermediate(self):
+        diffuser = DdimDiffuser(self.beta_scheduler, number_of_steps=5)
+        images = torch.randn(2, 3, 8, 8)
+
+        denoised_images = diffuser.denoise_batch(
+            images, self.model, return_intermediate=True
+        )
+
+        assert len(denoised_images) == 5
+        assert denoised_images[-1].shape == images.shape
+
+    def test_denoise_batch_parallel_seeds(self):
+        diffuser = DdimDiffuser(self.beta_scheduler, number_of_steps=5)
+        images = torch.randn(3, 2, 3, 8, 8)
+
+        denoised_images = diffuser.denoise_batch(
+            images, self.model, parallel_seeds=3
+        )
+
+        assert len(denoised_images) == 1
+        assert denoised_images[-1].shape == images.shape
+
+    @pytest.mark.parametrize("shape", [(3, 3, 8, 8), (2, 2, 3, 8, 8)])
+    def test_denoise_batch_parallel_seeds_shape_mismatch(self, shape):
+        diffuser = DdimDiffuser(self.beta_scheduler, number_of_steps=5)
+
+        with pytest.raises(ValueError):
+            diffuser.denoise_batch(
+                torch.randn(shape), self.model, parallel_seeds=3
+            )
+
+    def test_denoise_batch_mixed_precision(self):
+        torch.manual_seed(0)
+        model = ConvNoiseModel()
+        images = torch.randn(2, 3, 8, 8)
+        diffuser = DdimDiffuser(self.beta_scheduler, number_of_steps=5)
+        mixed_precision_diffuser = DdimDiffuser(
+            self.beta_scheduler, number_of_steps=5, mixed_precision=True
+        )
+
+        expected = diffuser.denoise_batch(images, model)[-1]
+        result = mixed_precision_diffuser.denoise_batch(images, model)[-1]
+
+        assert result.dtype == torch.float32
+        assert torch.allclose(result, expected, atol=5e-2)
+
+    @pytest.mark.skipif(
+        not torch.cuda.is_available(), reason="CUDA graphs require a GPU"
+    )
+    def test_denoise_batch_cuda_graph_matches_eager(self):
+        model = TimestepNoiseModel()
+        eager_diffuser = DdimDiffuser(
+            LinearBetaScheduler(steps=100), number_of_steps=5
+        ).to("cuda")
+        graph_diffuser = DdimDiffuser(
+            LinearBetaScheduler(steps=100), number_of_steps=5, cuda_graph=True
+        ).to("cuda")
+
+        for _ in range(2):  # The second call replays the cached graph.
+            images = torch.randn(2, 3, 8, 8, device="cuda")
+
+            expected = eager_diffuser.denoise_batch(
+                images, model, return_intermediate=True
+            )
+            result = graph_diffuser.denoise_batch(
+                images, model, return_intermediate=True
+            )
+
+            assert len(result) == len(expected)
+            for result_images, expected_images in zip(result, expected):
+                assert torch.allclose(
+                    result_images, expected_images, atol=1e-5
+                )
+
+            # Unrelated CUDA work reuses any memory freed after the capture.
+            graph_diffuser.cuda_graph = False
+            graph_diffuser.denoise_batch(
+                torch.randn(4, 3, 8, 8, device="cuda"), model
+            )
+            graph_diffuser.cuda_graph = True
+
+    @pytest.mark.skipif(
+        not torch.cuda.is_available(), reason="CUDA graphs require a GPU"
+    )
+    def test_denoise_batch_cuda_graph_with_eta(self):
+        model = TimestepNoiseModel()
+        diffuser = DdimDiffuser(
+            LinearBetaScheduler(steps=100),
+            number_of_steps=5,
+            eta=1.0,
+            cuda_graph=True,
+        ).to("cuda")
+        images = torch.randn(2, 3, 8, 8, device="cuda")
+
+        torch.manual_seed(0)
+        expected = diffuser.denoise_batch(images, model)[-1]
+
+        # An eager call with another batch size reallocates the noise buffer.
+        diffuser.cuda_graph = False
+        diffuser.denoise_batch(torch.randn(4, 3, 8, 8, device="cuda"), model)
+        diffuser.cuda_graph = True
+
+        torch.manual_seed(0)
+        result = diffuser.denoise_batch(images, model)[-1]
+
+        assert torch.isfinite(result).all()
+        assert torch.allclose(result, expected, atol=1e-5)
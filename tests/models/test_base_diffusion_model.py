@@ -0,0 +1,45 @@
+import torch
+
+from diffusion_models.gaussian_diffusion.beta_schedulers import \
+    LinearBetaScheduler
+from diffusion_models.gaussian_diffusion.ddimm_diffuser import DdimDiffuser
+from diffusion_models.models.SimpleUnet import SimpleUnet
+
+
+class TestBaseDiffusionModel:
+    def setup_method(self):
+        self.model = SimpleUnet(
+            diffuser=DdimDiffuser(LinearBetaScheduler(steps=10)),
+            image_channels=3,
+        )
+
+    def test_to_memory_format_keeps_device(self, mocker):
+        mock_diffuser_to = mocker.patch.object(DdimDiffuser, "to")
+
+        model = self.model.to(memory_format=torch.channels_last)
+
+        mock_diffuser_to.assert_not_called()
+        assert model.conv0.weight.is_contiguous(
+            memory_format=torch.channels_last
+        )
+
+    def test_to_device(self):
+        model = self.model.to("cpu")
+
+        assert model.diffuser.device == "cpu"
+        assert model.conv0.weight.device == torch.device("cpu")
+
+    def test_compiled_denoise_signature(self, mocker):
+        mock_denoise_batch = mocker.patch.object(DdimDiffuser, "denoise_batch")
+        images = torch.randn(2, 1, 3, 8, 8)
+
+        model = self.model.compile()
+        model.denoise(images, 2, True, False)
+
+        mock_denoise_batch.assert_called_once_with(
+            images=images,
+            model=model,
+            parallel_seeds=2,
+            return_intermediate=True,
+            verbose=False,
+        )